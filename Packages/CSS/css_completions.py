@@ -141,6 +141,9 @@ def parse_css_data(data):
     return props
 
 class CSSCompletions(sublime_plugin.EventListener):
+    cache_completions = True
+    completions_prefix_independent = True
+
     props = None
     rex = None
 
@@ -50,6 +50,8 @@ def indented_block(view, r):
     return False
 
 class BlockContext(sublime_plugin.EventListener):
+    context_keys = {"indented_block"}
+
     def on_query_context(self, view, key, operator, operand, match_all):
         if key == "indented_block":
             is_all = True
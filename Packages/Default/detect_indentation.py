@@ -56,7 +56,9 @@ class DetectIndentationCommand(sublime_plugin.TextCommand):
                 self.view.settings().set('translate_tabs_to_spaces', False)
 
 class DetectIndentationEventListener(sublime_plugin.EventListener):
-    def on_load(self, view):
-        if view.settings().get('detect_indentation'):
-            is_at_front = view.window() != None
+    def on_load_batch(self, views):
+        views = [v for v in views if v.settings().get('detect_indentation')]
+        for i, view in enumerate(views):
+            # Only the last view of a batch is left at the front
+            is_at_front = i == len(views) - 1 and view.window() != None
             view.run_command('detect_indentation', {'show_message': is_at_front})
@@ -157,6 +157,8 @@ class JumpHistoryUpdater(sublime_plugin.EventListener):
     Listens on the sublime text events and push the navigation history into the
     JumpHistory object
     """
+    command_names = {'move', 'drag_select', 'move_to', 'goto_definition'}
+
     def on_text_command(self, view, name, args):
         if view.settings().get('is_widget'):
             return
@@ -0,0 +1,72 @@
+import sublime, sublime_plugin
+import json
+
+class ToggleListenerProfilingCommand(sublime_plugin.ApplicationCommand):
+    def run(self):
+        enabled = not sublime_plugin.profiling_enabled
+        sublime_plugin.set_profiling_enabled(enabled)
+        if enabled:
+            sublime.status_message("Listener profiling enabled")
+        else:
+            sublime.status_message("Listener profiling disabled")
+
+    def is_checked(self):
+        return sublime_plugin.profiling_enabled
+
+class ResetListenerProfileCommand(sublime_plugin.ApplicationCommand):
+    def run(self):
+        sublime_plugin.reset_listener_profiles()
+
+class ShowListenerProfileCommand(sublime_plugin.ApplicationCommand):
+    def run(self, file = None, limit = 50):
+        report = sublime_plugin.listener_profile_report()
+
+        if file:
+            with open(file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=4)
+            sublime.status_message("Listener profile written to " + file)
+            return
+
+        w = sublime.active_window()
+        if not w:
+            return
+
+        v = w.new_file()
+        v.set_name("Slowest Listeners")
+        v.set_scratch(True)
+        text = format_report(report[:limit])
+        stats = sublime_plugin.async_queue_stats()
+        if stats is not None:
+            text += "\n" + format_queue_stats(stats)
+        v.run_command('append', {'characters': text})
+
+def format_report(report):
+    if not report:
+        return "No listener timings recorded. Enable profiling with toggle_listener_profiling\n"
+
+    header = "%10s %8s %10s %10s %10s %10s  %s" % (
+        "total ms", "calls", "mean ms", "p90 ms", "p99 ms", "max ms", "listener")
+    lines = [header, "-" * len(header)]
+    for p in report:
+        lines.append("%10.1f %8d %10.3f %10.2f %10.2f %10.2f  %s.%s" % (
+            p['total_ms'], p['count'], p['mean_ms'], p['p90_ms'], p['p99_ms'],
+            p['max_ms'], p['listener'], p['event']))
+    return "\n".join(lines) + "\n"
+
+def format_queue_stats(stats):
+    lines = ["Async queues: %d workers, %d pending (peak %d), %d completed" % (
+        stats['workers'], stats['pending'], stats['peak_pending'], stats['completed'])]
+    for q in stats['deepest']:
+        lines.append("%10d  %s, view %s" % (q['depth'], q['listener'], q['view_id']))
+    return "\n".join(lines) + "\n"
+
+class ReenableListenersCommand(sublime_plugin.ApplicationCommand):
+    def run(self):
+        demoted = sublime_plugin.demoted_listeners()
+        sublime_plugin.reenable_listeners()
+        for name, event in demoted:
+            print("re-enabled", name + "." + event)
+        sublime.status_message("Re-enabled %d listeners" % len(demoted))
+
+    def is_enabled(self):
+        return len(sublime_plugin.demoted_listeners()) > 0
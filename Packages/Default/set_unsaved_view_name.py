@@ -1,15 +1,14 @@
 import sublime, sublime_plugin
 import os.path
 import string
-import functools
 
 class SetUnsavedViewName(sublime_plugin.EventListener):
     setting_name = False
 
     dropped_chars = string.whitespace
 
-    pending = 0
-
+    # Bursts of edits, e.g., from a macro, only need the title updated once
+    @sublime_plugin.coalesce(20)
     def on_modified_async(self, view):
         if view.file_name() or view.is_loading():
             return
@@ -17,14 +16,9 @@ class SetUnsavedViewName(sublime_plugin.EventListener):
         if self.setting_name:
             return
 
-        self.pending += 1
-        sublime.set_timeout_async(functools.partial(self.update_title, view), 20)
+        self.update_title(view)
 
     def update_title(self, view):
-        self.pending -= 1
-        if self.pending != 0:
-            return
-
         if view.settings().get('set_unsaved_view_name') == False:
             return
 
@@ -129,6 +129,9 @@ class SortLinesCommand(sublime_plugin.TextCommand):
             permute_lines(uniquealise_list, view, edit)
 
 class SortSelectionCommand(sublime_plugin.TextCommand):
+    # is_enabled walks the whole selection, and only depends on it
+    cache_queries = True
+
     def run(self, edit, case_sensitive=False,
                         reverse=False,
                         remove_duplicates=False):
@@ -87,6 +87,8 @@ class HtmlTagCompletions(sublime_plugin.EventListener):
     Provide tag completions for HTML
     It matches just after typing the first letter of a tag name
     """
+    cache_completions = True
+
     def __init__(self):
         completion_list = self.default_completion_list()
         self.prefix_completion_dict = {}
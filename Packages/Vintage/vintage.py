@@ -114,6 +114,10 @@ def plugin_loaded():
 # Ensures the input state is reset when the view changes, or the user selects
 # with the mouse or non-vintage key bindings
 class InputStateTracker(sublime_plugin.EventListener):
+    context_keys = {"vi_action", "vi_has_action", "vi_has_register",
+        "vi_motion_mode", "vi_has_repeat_digit", "vi_has_input_state",
+        "vi_can_enter_text_object"}
+
     def on_activated(self, view):
         reset_input_state(view)
 
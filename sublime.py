@@ -1,5 +1,6 @@
 import sublime_api
 import sys
+import weakref
 
 class _LogWriter:
     def flush(self):
@@ -160,10 +161,34 @@ def set_timeout_async(f, timeout_ms = 0):
     sublime_api.set_timeout_async(f, timeout_ms)
 
 def active_window():
-    return Window(sublime_api.active_window())
+    return interned_window(sublime_api.active_window())
 
 def windows():
-    return [Window(id) for id in sublime_api.windows()]
+    return [interned_window(id) for id in sublime_api.windows()]
+
+# Live View and Window objects keyed by id. Handing out the same object for
+# an id keeps its lazily created Selection and Settings objects around for
+# as long as anything holds on to it
+_view_cache = weakref.WeakValueDictionary()
+_window_cache = weakref.WeakValueDictionary()
+
+def interned_view(view_id):
+    v = _view_cache.get(view_id)
+    if v is None:
+        v = View(view_id)
+        _view_cache[view_id] = v
+    return v
+
+def interned_window(window_id):
+    w = _window_cache.get(window_id)
+    if w is None:
+        w = Window(window_id)
+        _window_cache[window_id] = w
+    return w
+
+def forget_view(view_id):
+    """ Drops the interned View for view_id, called once the view is closed """
+    _view_cache.pop(view_id, None)
 
 class Window(object):
     def __init__(self, id):
@@ -186,7 +211,7 @@ class Window(object):
         if view_id == 0:
             return None
         else:
-            return View(view_id)
+            return interned_view(view_id)
 
     def run_command(self, cmd, args = None):
         sublime_api.window_run_command(self.window_id, cmd, args)
@@ -235,7 +260,7 @@ class Window(object):
 
     def views(self):
         view_ids = sublime_api.window_views(self.window_id)
-        return [View(x) for x in view_ids]
+        return [interned_view(x) for x in view_ids]
 
     def active_view_in_group(self, group):
         view_id = sublime_api.window_active_view_in_group(self.window_id, group)
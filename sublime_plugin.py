@@ -1,36 +1,1084 @@
 import sublime
+import builtins
 import threading
+import bisect
+import collections
+import concurrent.futures
+import heapq
+import time
 import imp
 import importlib
+import importlib.util
+import inspect
+import hashlib
+import json
+import marshal
+import mmap
 import os
+import struct
 import sys
 import zipfile
+import zlib
+
+try:
+    from importlib.machinery import ModuleSpec
+except ImportError:
+    # Python 3.3 only knows the find_module / load_module protocol
+    ModuleSpec = None
 import sublime_api
 import traceback
 
 api_ready = False
 
-application_command_classes = []
-window_command_classes = []
-text_command_classes = []
+# Startup tracing. When SUBLIME_PLUGIN_STARTUP_TRACE is set in the
+# environment, the time spent importing each plugin module and running its
+# plugin_loaded() is recorded, and written as a Chrome trace-event file to
+# the cache path once the API is ready
+startup_trace_enabled = bool(os.environ.get("SUBLIME_PLUGIN_STARTUP_TRACE"))
+startup_trace_events = []
+startup_trace_origin = time.perf_counter()
+
+class trace_span(object):
+    def __init__(self, name, category):
+        self.name = name
+        self.category = category
+        self.start = None
+
+    def __enter__(self):
+        if startup_trace_enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.start is None:
+            return
+
+        end = time.perf_counter()
+        startup_trace_events.append({
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': (self.start - startup_trace_origin) * 1e6,
+            'dur': (end - self.start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident()})
+
+def write_startup_trace():
+    global startup_trace_enabled
+
+    if not startup_trace_enabled:
+        return
+    startup_trace_enabled = False
+
+    path = os.path.join(sublime.cache_path(), "startup_trace.json")
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': startup_trace_events,
+                'displayTimeUnit': 'ms'}, f)
+        print("startup trace written to", path)
+    except (IOError, OSError):
+        traceback.print_exc()
+
+    del startup_trace_events[:]
+
+# Event recording. When SUBLIME_PLUGIN_EVENT_TRACE names a file, every call
+# made into the event dispatchers is appended to it as one JSON array per
+# line: [ms since start, dispatcher name, args...]. sublime_replay.py plays
+# such a trace back against a stand-in sublime_api
+class EventRecorder(object):
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.last_flush = self.origin
+
+    def record(self, name, args):
+        now = time.perf_counter()
+        line = json.dumps([round((now - self.origin) * 1000.0, 3), name] + list(args),
+            separators=(',', ':'), default=repr)
+
+        with self.lock:
+            if self.file is None:
+                return
+            try:
+                self.file.write(line)
+                self.file.write("\n")
+                if now - self.last_flush > 1.0:
+                    self.file.flush()
+                    self.last_flush = now
+            except (IOError, OSError):
+                traceback.print_exc()
+                self.file = None
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+event_recorder = None
+if os.environ.get("SUBLIME_PLUGIN_EVENT_TRACE"):
+    try:
+        event_recorder = EventRecorder(os.environ["SUBLIME_PLUGIN_EVENT_TRACE"])
+    except (IOError, OSError):
+        traceback.print_exc()
+
+def recorded(f):
+    """ Decorator for dispatchers, a no-op unless events are being recorded """
+    if event_recorder is None:
+        return f
+
+    name = f.__name__
+
+    def call(*args):
+        event_recorder.record(name, args)
+        return f(*args)
+
+    call.__name__ = name
+    call.__qualname__ = f.__qualname__
+    call.__doc__ = f.__doc__
+    return call
+
+# Stall watchdog. Synchronous entry points decorated with watch_stalls record
+# when the outermost one on the main thread started in busy_call. Calls made
+# from other threads can't block the main thread and aren't watched. Once a
+# call has run longer than stall_threshold_ms, the watchdog thread samples the
+# stack of the main thread every stall_sample_interval_ms until it returns,
+# and then writes the samples as collapsed stacks (flamegraph.pl / speedscope
+# input) to the Stalls folder of the cache path. A threshold of 0 disables the
+# watchdog
+stall_threshold_ms = 1000
+stall_sample_interval_ms = 10
+stall_reports_kept = 20
+stall_watchdog = None
+
+# The thread the plugin host imports this module on, and dispatches events from
+main_thread_id = threading.get_ident()
+
+# (entry point name, start time, thread id) of the running main thread call
+busy_call = None
+
+def watch_stalls(f):
+    name = f.__qualname__
+
+    def call(*args):
+        global busy_call
+        if stall_watchdog is None or threading.get_ident() != main_thread_id \
+                or busy_call is not None:
+            return f(*args)
+
+        busy_call = (name, time.perf_counter(), main_thread_id)
+        try:
+            return f(*args)
+        finally:
+            busy_call = None
+
+    call.__name__ = f.__name__
+    call.__qualname__ = name
+    call.__doc__ = f.__doc__
+    return call
+
+def collapse_stack(frame, root):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    names.append(root)
+    names.reverse()
+    return ";".join(names)
+
+class StallWatchdog(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self, name="sublime_plugin stall watchdog")
+        self.daemon = True
+        self.stopped = False
+        self.stall = None
+        self.stacks = {}
+
+    def run(self):
+        while not self.stopped:
+            call = busy_call
+            if call is not self.stall and self.stall is not None:
+                self.write_report()
+
+            if call is None:
+                time.sleep(stall_threshold_ms / 1000.0)
+                continue
+
+            elapsed_ms = (time.perf_counter() - call[1]) * 1000.0
+            if elapsed_ms < stall_threshold_ms:
+                time.sleep((stall_threshold_ms - elapsed_ms) / 1000.0)
+                continue
+
+            self.stall = call
+            frame = sys._current_frames().get(call[2])
+            if frame is not None:
+                stack = collapse_stack(frame, call[0])
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            del frame
+            time.sleep(stall_sample_interval_ms / 1000.0)
+
+    def write_report(self):
+        name, start = self.stall[0], self.stall[1]
+        duration_ms = (time.perf_counter() - start) * 1000.0
+        stacks = self.stacks
+        self.stall = None
+        self.stacks = {}
+
+        folder = os.path.join(sublime.cache_path(), "Stalls")
+        now = time.time()
+        path = os.path.join(folder, "%s.%03d-%s.folded" % (
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(now)),
+            int(now * 1000) % 1000, name))
+        try:
+            os.makedirs(folder, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write("%s %d\n" % (stack, count))
+
+            reports = sorted(n for n in os.listdir(folder) if n.endswith(".folded"))
+            for n in reports[:-stall_reports_kept]:
+                os.remove(os.path.join(folder, n))
+        except (IOError, OSError):
+            traceback.print_exc()
+            return
+
+        print("%s blocked the main thread for %.0f ms, stacks written to %s" % (
+            name, duration_ms, path))
+
+def set_stall_watchdog(threshold_ms, sample_interval_ms = None):
+    """ Starts, reconfigures or, with a threshold of 0, stops the watchdog """
+    global stall_watchdog, stall_threshold_ms, stall_sample_interval_ms
+
+    stall_threshold_ms = threshold_ms
+    if sample_interval_ms is not None:
+        stall_sample_interval_ms = sample_interval_ms
+
+    if threshold_ms <= 0:
+        if stall_watchdog is not None:
+            stall_watchdog.stopped = True
+            stall_watchdog = None
+    elif stall_watchdog is None:
+        stall_watchdog = StallWatchdog()
+        stall_watchdog.start()
+
+# Held while plugins are loaded or unloaded and while the dispatch tables
+# are rebuilt. Deferred modules are loaded on whichever thread first uses
+# them, often the async thread
+plugin_lock = threading.RLock()
+
+# Events whose dispatch tables are out of date, see rebuild_dispatch_tables
+stale_events = set()
+
+class PluginList(object):
+    """
+    Insertion ordered collection of registered plugins, with O(1) append and
+    remove. Plugins are keyed by identity and reference counted, so a class
+    that several modules expose stays registered until all of them have
+    removed it. Changes to the listener list of an event mark that event's
+    dispatch table as stale
+    """
+    def __init__(self, event = None):
+        self.event = event
+        # id(plugin) -> [plugin, number of registrations]
+        self.items = collections.OrderedDict()
+
+    def append(self, p):
+        item = self.items.get(id(p))
+        if item is not None:
+            item[1] += 1
+            return
+
+        self.items[id(p)] = [p, 1]
+        if self.event:
+            stale_events.add(self.event)
+
+    def discard(self, p):
+        item = self.items.get(id(p))
+        if item is None:
+            return
+
+        item[1] -= 1
+        if item[1] == 0:
+            del self.items[id(p)]
+            if self.event:
+                stale_events.add(self.event)
+
+    def remove(self, p):
+        if id(p) not in self.items:
+            raise ValueError("plugin not registered", p)
+        self.discard(p)
+
+    def __iter__(self):
+        return iter([item[0] for item in self.items.values()])
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, p):
+        return id(p) in self.items
+
+application_command_classes = PluginList()
+window_command_classes = PluginList()
+text_command_classes = PluginList()
 
 all_command_classes = [application_command_classes, window_command_classes, text_command_classes]
 
-all_callbacks = {'on_new': [], 'on_clone': [], 'on_load': [], 'on_pre_close': [], 'on_close': [],
-    'on_pre_save': [], 'on_post_save': [], 'on_modified': [],
-    'on_selection_modified': [],'on_activated': [], 'on_deactivated': [],
-    'on_query_context': [], 'on_query_completions': [],
-    'on_text_command': [], 'on_window_command': [],
-
-    'on_modified_async': [],
-    'on_selection_modified_async': [],
-    'on_pre_save_async': [],
-    'on_post_save_async': [],
-    'on_activated_async': [],
-    'on_deactivated_async': [],
-    'on_new_async': [],
-    'on_load_async': [],
-    'on_clone_async': []}
+# Module name -> [(plugin, PluginLists it was added to)], so unloading a
+# module only touches that module's plugins
+plugin_registry = {}
+
+def register_plugin(modulename, p, lists):
+    for l in lists:
+        l.append(p)
+    plugin_registry.setdefault(modulename, []).append((p, lists))
+
+def unregister_plugins(modulename):
+    for p, lists in plugin_registry.pop(modulename, ()):
+        for l in lists:
+            l.discard(p)
+        # The class may still be registered through another module
+        if isinstance(p, type) and not any(p in l for l in lists):
+            unregister_command_class(p)
+
+def register_listener(modulename, obj):
+    register_plugin(modulename, obj,
+        [listeners for name, listeners in all_callbacks.items() if hasattr(obj, name)])
+
+# Registered command classes by command name, and the name of each
+# registered class, computed once at registration
+application_commands_by_name = {}
+window_commands_by_name = {}
+text_commands_by_name = {}
+
+command_names = {}
+
+commands_by_name_for_list = (
+    (application_command_classes, application_commands_by_name),
+    (window_command_classes, window_commands_by_name),
+    (text_command_classes, text_commands_by_name))
+
+def register_command_class(modulename, cls, cmd_cls_list, commands_by_name):
+    register_plugin(modulename, cls, [cmd_cls_list])
+
+    for method in query_methods:
+        command_signature(cls, method)
+
+    name = class_command_name(cls)
+    if name is not None:
+        commands_by_name[name] = cls
+
+def unregister_command_class(cls):
+    for method in query_methods:
+        command_signatures.pop((cls, method), None)
+
+    name = command_names.pop(cls, None)
+    if name is None:
+        return
+
+    for cmd_cls_list, commands_by_name in commands_by_name_for_list:
+        if commands_by_name.get(name) is not cls:
+            continue
+
+        del commands_by_name[name]
+        # Fall back to the latest other class still registered under the name
+        for c in reversed(list(cmd_cls_list)):
+            if command_names.get(c) == name:
+                commands_by_name[name] = c
+                break
+
+# The keyword arguments each command's is_enabled/is_visible/is_checked
+# accept, keyed by (class, method name). Each value is (takes **kwargs,
+# accepted names, required names), or None if the method couldn't be
+# introspected
+query_methods = ('is_enabled', 'is_visible', 'is_checked')
+command_signatures = {}
+
+def command_signature(cls, method):
+    key = (cls, method)
+    try:
+        return command_signatures[key]
+    except KeyError:
+        pass
+
+    sig = None
+    try:
+        params = list(inspect.signature(getattr(cls, method)).parameters.values())[1:]
+
+        var_kw = False
+        accepted = set()
+        required = set()
+        for p in params:
+            if p.kind == p.VAR_KEYWORD:
+                var_kw = True
+            elif p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY):
+                accepted.add(p.name)
+                if p.default is p.empty:
+                    required.add(p.name)
+
+        sig = (var_kw, frozenset(accepted), frozenset(required))
+    except (TypeError, ValueError):
+        pass
+
+    command_signatures[key] = sig
+    return sig
+
+def call_query_method(cmd, method, args):
+    """
+    Calls the given query method of cmd with args if its signature accepts
+    them, and with no arguments otherwise
+    """
+    f = getattr(cmd, method)
+    if not args:
+        return f()
+
+    sig = command_signature(cmd.__class__, method)
+    if sig is None:
+        try:
+            return f(**args)
+        except TypeError:
+            return f()
+
+    var_kw, accepted, required = sig
+    if var_kw or (accepted.issuperset(args) and required.issubset(args)):
+        return f(**args)
+    else:
+        return f()
+
+def find_command_class(name):
+    """ Returns the registered command class for name, or None """
+    return (text_commands_by_name.get(name) or
+        window_commands_by_name.get(name) or
+        application_commands_by_name.get(name))
+
+all_callbacks = dict((name, PluginList(name)) for name in (
+    'on_new', 'on_clone', 'on_load', 'on_pre_close', 'on_close',
+    'on_pre_save', 'on_post_save', 'on_modified',
+    'on_selection_modified', 'on_activated', 'on_deactivated',
+    'on_query_context', 'on_query_completions',
+    'on_text_command', 'on_window_command',
+
+    'on_modified_async',
+    'on_selection_modified_async',
+    'on_pre_save_async',
+    'on_post_save_async',
+    'on_activated_async',
+    'on_deactivated_async',
+    'on_new_async',
+    'on_load_async',
+    'on_clone_async',
+
+    'on_new_batch',
+    'on_clone_batch',
+    'on_load_batch',
+    'on_new_batch_async',
+    'on_clone_batch_async',
+    'on_load_batch_async'))
+
+# Events that can also be dispatched for many views in one call, and the
+# name of the listener method taking the whole list of views. A listener
+# implementing the batch method is called once per batch, and with a one
+# element list when a single view fires the event
+batch_events = {
+    'on_new': 'on_new_batch',
+    'on_clone': 'on_clone_batch',
+    'on_load': 'on_load_batch',
+    'on_new_async': 'on_new_batch_async',
+    'on_clone_async': 'on_clone_batch_async',
+    'on_load_async': 'on_load_batch_async'}
+
+# Events whose callbacks take a single View argument
+view_events = frozenset(name for name in all_callbacks
+    if name not in ('on_query_context', 'on_query_completions',
+        'on_text_command', 'on_window_command')
+    and name not in batch_events.values())
+
+# Bound callbacks for each event, compiled from all_callbacks. Each table is
+# an immutable tuple, and the whole dict is replaced at once, so a dispatcher
+# never sees a partially updated table.
+dispatch_tables = dict((name, ()) for name in all_callbacks)
+
+# For each batchable event, (per view callbacks of listeners without a batch
+# method, batch callbacks), used by run_view_batch_callbacks
+batch_tables = dict((name, ((), ())) for name in batch_events)
+
+# When enabled, every compiled callback records its wall time into a
+# ListenerProfile, keyed by (listener class name, event)
+profiling_enabled = False
+listener_profiles = {}
+
+class ListenerProfile(object):
+    # Upper bounds of the histogram buckets, in milliseconds. Anything slower
+    # than the last bound goes into a final overflow bucket
+    bucket_limits = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+    def __init__(self, listener_name, event):
+        self.listener_name = listener_name
+        self.event = event
+        self.buckets = [0] * (len(self.bucket_limits) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.buckets[bisect.bisect_left(self.bucket_limits, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, p):
+        """ Returns the upper bound of the bucket holding the p-th percentile """
+        if self.count == 0:
+            return 0.0
+
+        threshold = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= threshold:
+                break
+
+        if i < len(self.bucket_limits):
+            return min(float(self.bucket_limits[i]), self.max_ms)
+        else:
+            return self.max_ms
+
+    def to_dict(self):
+        return {
+            'listener': self.listener_name,
+            'event': self.event,
+            'count': self.count,
+            'total_ms': self.total_ms,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max_ms,
+            'bucket_limits_ms': list(self.bucket_limits),
+            'buckets': list(self.buckets)}
+
+def listener_name(obj):
+    cls = obj.__class__
+    return cls.__module__ + "." + cls.__name__
+
+def profiled_callback(obj, event, callback):
+    key = (listener_name(obj), event)
+    profile = listener_profiles.get(key)
+    if profile is None:
+        profile = ListenerProfile(key[0], event)
+        listener_profiles[key] = profile
+
+    clock = time.perf_counter
+
+    def call(*args):
+        start = clock()
+        try:
+            return callback(*args)
+        finally:
+            profile.add((clock() - start) * 1000.0)
+
+    return call
+
+def set_profiling_enabled(flag):
+    global profiling_enabled
+    profiling_enabled = flag
+    rebuild_dispatch_tables(True)
+
+def reset_listener_profiles():
+    listener_profiles.clear()
+    rebuild_dispatch_tables(True)
+
+def listener_profile_report():
+    """ Returns the recorded profiles as dicts, slowest listeners first """
+    profiles = [p for p in list(listener_profiles.values()) if p.count > 0]
+    profiles.sort(key=lambda p: p.total_ms, reverse=True)
+    return [p.to_dict() for p in profiles]
+
+# Time budget of synchronous listener callbacks. A listener that takes longer
+# than listener_budget_ms listener_budget_strikes times within
+# listener_budget_window_s seconds is demoted until reenable_listeners() is
+# called: with the 'async' policy its calls are moved to the async thread,
+# and with 'skip' they are skipped. Only events in async_demotable_events are
+# demoted; for the others, whose results or timing the caller relies on, a
+# warning is printed instead. A budget of 0 disables the policy
+listener_budget_ms = 100
+listener_budget_strikes = 3
+listener_budget_window_s = 10.0
+listener_budget_policy = 'async'
+listener_budgets = {}
+
+# Synchronous events whose callbacks can run later on the async thread
+# without changing what the caller sees
+async_demotable_events = frozenset([
+    'on_new', 'on_clone', 'on_load', 'on_post_save', 'on_modified',
+    'on_selection_modified', 'on_activated', 'on_deactivated',
+    'on_new_batch', 'on_clone_batch', 'on_load_batch'])
+
+class ListenerBudget(object):
+    def __init__(self, listener_name, event):
+        self.listener_name = listener_name
+        self.event = event
+        self.overruns = collections.deque()
+        self.demoted = False
+        self.warned = False
+        self.lock = threading.Lock()
+
+    def add(self, ms):
+        if ms <= listener_budget_ms:
+            return
+
+        with self.lock:
+            now = time.perf_counter()
+            self.overruns.append(now)
+            while now - self.overruns[0] > listener_budget_window_s:
+                self.overruns.popleft()
+
+            if (self.demoted or self.warned or
+                    len(self.overruns) < listener_budget_strikes):
+                return
+
+            if self.event in async_demotable_events:
+                self.demoted = True
+            else:
+                self.warned = True
+
+        if not self.demoted:
+            action = "it can't be deferred, so it keeps running"
+        elif self.moves_to_async():
+            action = ("moving its calls to the async thread until "
+                "reenable_listeners is run")
+        else:
+            action = "skipping its calls until reenable_listeners is run"
+        print("%s.%s took %.0f ms, over its %d ms budget %d times in %g s: %s" % (
+            self.listener_name, self.event, ms, listener_budget_ms,
+            len(self.overruns), listener_budget_window_s, action))
+
+    def moves_to_async(self):
+        return listener_budget_policy == 'async'
+
+    def reset(self):
+        with self.lock:
+            self.overruns.clear()
+            self.demoted = False
+            self.warned = False
+
+def budgeted_callback(obj, event, callback):
+    key = (listener_name(obj), event)
+    budget = listener_budgets.get(key)
+    if budget is None:
+        budget = ListenerBudget(key[0], event)
+        listener_budgets[key] = budget
+
+    clock = time.perf_counter
+
+    def call(*args):
+        if budget.demoted:
+            if budget.moves_to_async():
+                sublime.set_timeout_async(lambda: callback(*args), 0)
+            return None
+
+        start = clock()
+        try:
+            return callback(*args)
+        finally:
+            budget.add((clock() - start) * 1000.0)
+
+    return call
+
+def set_listener_budget(budget_ms = None, strikes = None, window_s = None, policy = None):
+    global listener_budget_ms, listener_budget_strikes
+    global listener_budget_window_s, listener_budget_policy
+
+    if policy is not None and policy not in ('async', 'skip'):
+        raise ValueError("listener budget policy must be 'async' or 'skip'", policy)
+
+    if budget_ms is not None:
+        listener_budget_ms = budget_ms
+    if strikes is not None:
+        listener_budget_strikes = max(1, strikes)
+    if window_s is not None:
+        listener_budget_window_s = window_s
+    if policy is not None:
+        listener_budget_policy = policy
+    rebuild_dispatch_tables(True)
+
+def demoted_listeners():
+    """ Returns the (listener, event) pairs currently demoted """
+    return sorted(key for key, b in list(listener_budgets.items()) if b.demoted)
+
+def reenable_listeners():
+    """ Lifts the demotion of every listener, returning how many there were """
+    demoted = demoted_listeners()
+    for b in list(listener_budgets.values()):
+        b.reset()
+    return len(demoted)
+
+def coalesce(min_interval_ms = 0):
+    """
+    Decorator for *_async view event handlers of an EventListener. Events
+    that arrive while one is already pending for the same view are folded
+    into it, so only the latest one is delivered, and deliveries for a view
+    are at least min_interval_ms apart
+    """
+    def decorate(f):
+        f.coalesce_interval_ms = min_interval_ms
+        return f
+    return decorate
+
+class CoalescedCallback(object):
+    def __init__(self, callback, min_interval_ms):
+        self.callback = callback
+        self.min_interval_ms = min_interval_ms
+        self.lock = threading.Lock()
+        # view_id -> latest undelivered View
+        self.pending = {}
+        # view_id -> time of the last delivery
+        self.last_delivery = {}
+
+    def __call__(self, view):
+        view_id = view.view_id
+        with self.lock:
+            already_scheduled = view_id in self.pending
+            self.pending[view_id] = view
+            if already_scheduled:
+                return
+
+            last = self.last_delivery.get(view_id)
+
+        delay = 0
+        if last is not None:
+            elapsed_ms = (time.perf_counter() - last) * 1000.0
+            delay = max(0, int(self.min_interval_ms - elapsed_ms))
+
+        sublime.set_timeout_async(lambda: self.deliver(view_id), delay)
+
+    def deliver(self, view_id):
+        with self.lock:
+            view = self.pending.pop(view_id, None)
+            self.last_delivery[view_id] = time.perf_counter()
+
+        if view is None:
+            return
+
+        try:
+            self.callback(view)
+        except:
+            traceback.print_exc()
+
+    def forget_view(self, view_id):
+        with self.lock:
+            self.last_delivery.pop(view_id, None)
+
+# When async_workers is above zero, *_async callbacks are handed from the
+# async thread to a pool of that many threads, so one slow listener doesn't
+# hold up the others. Calls for the same (listener, view) still run in order,
+# as batch calls for the same listener do
+async_workers = 0
+async_queues = None
+
+class SerialQueues(object):
+    """ Runs queued calls on a thread pool, one key at a time """
+    def __init__(self, workers):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        # key -> deque of (callback, args) not yet run
+        self.queues = {}
+        # key -> listener name, for the stats
+        self.names = {}
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+
+    def submit(self, key, name, callback, args):
+        with self.lock:
+            queue = self.queues.get(key)
+            start = queue is None
+            if start:
+                queue = collections.deque()
+                self.queues[key] = queue
+                self.names[key] = name
+            queue.append((callback, args))
+            self.pending += 1
+            if self.pending > self.peak_pending:
+                self.peak_pending = self.pending
+
+        if start:
+            try:
+                self.executor.submit(self.drain, key)
+            except RuntimeError:
+                # Shut down by set_async_workers, run it on the calling thread
+                self.drain(key)
+
+    def drain(self, key):
+        while True:
+            with self.lock:
+                queue = self.queues[key]
+                if not queue:
+                    del self.queues[key]
+                    del self.names[key]
+                    return
+                callback, args = queue.popleft()
+                self.pending -= 1
+
+            try:
+                callback(*args)
+            except:
+                traceback.print_exc()
+
+            with self.lock:
+                self.completed += 1
+
+    def shutdown(self):
+        # Calls already queued are still run
+        self.executor.shutdown(wait=False)
+
+    def stats(self, limit = 10):
+        with self.lock:
+            depths = [(len(q), self.names[key], key[1])
+                for key, q in self.queues.items()]
+            pending, peak, completed = self.pending, self.peak_pending, self.completed
+
+        depths.sort(key=lambda d: d[0], reverse=True)
+        return {
+            'pending': pending,
+            'peak_pending': peak,
+            'completed': completed,
+            'busy_queues': len(depths),
+            'deepest': [{'listener': name, 'view_id': view_id, 'depth': depth}
+                for depth, name, view_id in depths[:limit]]}
+
+def concurrent_callback(obj, callback, queues):
+    name = listener_name(obj)
+    listener_id = id(obj)
+
+    # queues is bound here, as tables compiled before set_async_workers
+    # changed it may still be dispatched through
+    def call(arg):
+        # A View, or a list of them for batch events
+        view_id = getattr(arg, 'view_id', None)
+        queues.submit((listener_id, view_id), name, callback, (arg,))
+
+    return call
+
+def set_async_workers(workers):
+    """ Sets the size of the async callback pool, 0 runs them on the async thread """
+    global async_workers, async_queues
+
+    previous = async_queues
+
+    async_workers = workers
+    if workers > 0:
+        async_queues = SerialQueues(workers)
+    else:
+        async_queues = None
+    rebuild_dispatch_tables(True)
+
+    # Only once the new tables are in place
+    if previous is not None:
+        previous.shutdown()
+
+def async_queue_stats():
+    """ Returns the queue depths of concurrent async dispatch, or None when off """
+    queues = async_queues
+    if queues is None:
+        return None
+    stats = queues.stats()
+    stats['workers'] = async_workers
+    return stats
+
+def fuzzy_match(prefix, text):
+    """ True if the characters of prefix appear in order in text, ignoring case """
+    text = text.lower()
+    pos = 0
+    for c in prefix.lower():
+        pos = text.find(c, pos) + 1
+        if pos == 0:
+            return False
+    return True
+
+class CachedCompletions(object):
+    """
+    Wraps the on_query_completions of a listener that sets cache_completions.
+    The last normalised result for each view is kept, and reused when the
+    view, scope and the word start of every location match: as is for the same prefix and
+    change_count, and filtered when the prefix has grown since, if the
+    listener also sets completions_prefix_independent
+    """
+    def __init__(self, callback, narrow):
+        self.callback = callback
+        self.narrow = narrow
+        self.lock = threading.Lock()
+        # view_id -> (change_count, scope, word_starts, prefix, completions, flags)
+        self.entries = {}
+
+    def __call__(self, view, prefix, locations):
+        change_count = view.change_count()
+        scope = view.scope_name(locations[0])
+        # With the prefix, these also tell apart the locations of the query
+        word_starts = tuple(pt - len(prefix) for pt in locations)
+
+        with self.lock:
+            entry = self.entries.get(view.view_id)
+
+        if entry is not None:
+            e_change_count, e_scope, e_word_starts, e_prefix, completions, flags = entry
+            if e_scope == scope and e_word_starts == word_starts:
+                if e_prefix == prefix and e_change_count == change_count:
+                    return (completions, flags)
+
+                if (self.narrow and e_prefix and len(prefix) > len(e_prefix)
+                        and prefix.startswith(e_prefix)):
+                    narrowed = [c for c in completions
+                        if fuzzy_match(prefix, completion_trigger(c))]
+                    # An empty result would still inhibit the other completions
+                    if narrowed or not flags:
+                        return (narrowed, flags)
+
+        res = self.callback(view, prefix, locations)
+
+        flags = 0
+        if isinstance(res, tuple):
+            completions = [normalise_completion(c) for c in res[0]]
+            flags = res[1]
+        elif isinstance(res, list):
+            completions = [normalise_completion(c) for c in res]
+        else:
+            return res
+
+        with self.lock:
+            if completions or not flags:
+                self.entries[view.view_id] = (change_count, scope, word_starts,
+                    prefix, completions, flags)
+            else:
+                self.entries.pop(view.view_id, None)
+
+        return (completions, flags)
+
+    def forget_view(self, view_id):
+        with self.lock:
+            self.entries.pop(view_id, None)
+
+def compile_callback(obj, event):
+    method = getattr(obj, event)
+
+    callback = method
+    if profiling_enabled:
+        callback = profiled_callback(obj, event, method)
+
+    if listener_budget_ms > 0 and not event.endswith('_async'):
+        callback = budgeted_callback(obj, event, callback)
+
+    queues = async_queues
+    if queues is not None and event.endswith('_async'):
+        callback = concurrent_callback(obj, callback, queues)
+
+    interval = getattr(method, 'coalesce_interval_ms', None)
+    if interval is not None and event.endswith('_async') and event in view_events:
+        callback = CoalescedCallback(callback, interval)
+
+    if event == 'on_query_completions' and getattr(obj, 'cache_completions', False):
+        callback = CachedCompletions(callback,
+            getattr(obj, 'completions_prefix_independent', False))
+
+    return callback
+
+# For on_query_context, the callbacks of each declared context key: listeners
+# that declare context_keys are only called for those keys, listeners that
+# don't are called for every key, and are the only ones called for keys no
+# listener declares. Stored as (key -> callbacks, fallback callbacks)
+context_key_index = ({}, ())
+
+# The same for on_text_command and on_window_command, keyed by command name
+# from the listeners' command_names
+text_command_index = ({}, ())
+window_command_index = ({}, ())
+
+def build_key_index(listeners, callbacks, attr):
+    declared = set()
+    for obj in listeners:
+        keys = getattr(obj, attr, None)
+        if keys is not None:
+            declared.update(keys)
+
+    index = {}
+    for key in declared:
+        index[key] = tuple(cb for obj, cb in zip(listeners, callbacks)
+            if getattr(obj, attr, None) is None or key in getattr(obj, attr))
+
+    fallback = tuple(cb for obj, cb in zip(listeners, callbacks)
+        if getattr(obj, attr, None) is None)
+
+    return (index, fallback)
+
+def single_view_callback(batch_callback):
+    def call(view):
+        return batch_callback([view])
+    return call
+
+def rebuild_dispatch_tables(full = False):
+    """ Recompiles the tables of stale events, or of all events if full is set """
+    global dispatch_tables, batch_tables, context_key_index, completion_providers
+    global text_command_index, window_command_index
+
+    with plugin_lock:
+        if full:
+            events = set(all_callbacks)
+        else:
+            events = set(stale_events)
+        stale_events.difference_update(events)
+
+        if not events:
+            return
+
+        # The tables of a batchable event depend on the listeners of both of
+        # its methods
+        for name, batch_name in batch_events.items():
+            if name in events or batch_name in events:
+                events.update((name, batch_name))
+
+        tables = dict(dispatch_tables)
+        snapshots = {}
+        for name in events:
+            listeners = list(all_callbacks[name])
+            snapshots[name] = listeners
+            tables[name] = tuple(compile_callback(obj, name) for obj in listeners)
+
+        new_batch_tables = dict(batch_tables)
+        for name, batch_name in batch_events.items():
+            if name not in snapshots:
+                continue
+
+            per_view = tuple(cb for obj, cb in zip(snapshots[name], tables[name])
+                if not hasattr(obj, batch_name))
+            new_batch_tables[name] = (per_view, tables[batch_name])
+
+            # Listeners with only the batch method still see single view events
+            tables[name] += tuple(single_view_callback(cb)
+                for obj, cb in zip(snapshots[batch_name], tables[batch_name])
+                if not hasattr(obj, name))
+
+        dispatch_tables = tables
+        batch_tables = new_batch_tables
+
+        if 'on_query_context' in snapshots:
+            context_key_index = build_key_index(snapshots['on_query_context'],
+                tables['on_query_context'], 'context_keys')
+
+        if 'on_text_command' in snapshots:
+            text_command_index = build_key_index(snapshots['on_text_command'],
+                tables['on_text_command'], 'command_names')
+
+        if 'on_window_command' in snapshots:
+            window_command_index = build_key_index(snapshots['on_window_command'],
+                tables['on_window_command'], 'command_names')
+
+        if 'on_query_completions' in snapshots:
+            completion_providers = tuple(zip(
+                [listener_name(obj) for obj in snapshots['on_query_completions']],
+                tables['on_query_completions']))
 
 def unload_module(module):
     if "plugin_unloaded" in module.__dict__:
@@ -40,36 +1088,153 @@ def unload_module(module):
         module.unload_handler()
 
     # Unload the old plugins
-    if "plugins" in module.__dict__:
-        for p in module.plugins:
-            for cmd_cls_list in all_command_classes:
-                try:
-                    cmd_cls_list.remove(p)
-                except ValueError:
-                    pass
-            for c in all_callbacks.values():
-                try:
-                    c.remove(p)
-                except ValueError:
-                    pass
+    unregister_plugins(module.__name__)
 
 def unload_plugin(modulename):
-    print("unloading plugin", modulename)
+    with plugin_lock:
+        print("unloading plugin", modulename)
+
+        plugin_module_names.discard(modulename)
 
-    was_loaded = modulename in sys.modules
-    if was_loaded:
-        m = sys.modules[modulename]
-        unload_module(m)
+        deferred = deferred_modules.pop(modulename, None)
+        if deferred:
+            deferred.unregister()
+            rebuild_dispatch_tables()
+
+        was_loaded = modulename in sys.modules
+        if was_loaded:
+            m = sys.modules[modulename]
+            unload_module(m)
+            rebuild_dispatch_tables()
 
 def reload_plugin(modulename):
-    print("reloading plugin", modulename)
+    with plugin_lock:
+        print("reloading plugin", modulename)
 
-    if modulename in sys.modules:
-        m = sys.modules[modulename]
-        unload_module(m)
-        m = imp.reload(m)
-    else:
-        m = importlib.import_module(modulename)
+        deferred = deferred_modules.pop(modulename, None)
+        if deferred:
+            deferred.unregister()
+
+        if lazy_loading and modulename not in sys.modules:
+            if defer_plugin(modulename):
+                return
+
+        # Modules that imported from this one hold on to its old objects, so
+        # they're reloaded after it, each after the modules it imports from
+        dependents = []
+        if modulename in sys.modules:
+            dependents = dependent_modules(modulename)
+
+        load_plugin(modulename)
+
+        for name in dependents:
+            print("reloading dependent module", name)
+            if name in plugin_module_names:
+                load_plugin(name)
+            else:
+                with import_recorder(name):
+                    imp.reload(sys.modules[name])
+
+# Names of the modules loaded through load_plugin
+plugin_module_names = set()
+
+# Module name -> names of the modules it imported while it was executing,
+# for modules executed while a plugin module was being loaded. Used to find
+# the modules to reload along with a plugin module
+module_imports = {}
+
+class import_recorder(object):
+    """
+    Records the imports made while a module is loaded into module_imports,
+    by wrapping builtins.__import__ for the duration
+    """
+    def __init__(self, modulename):
+        self.modulename = modulename
+
+    def __enter__(self):
+        module_imports[self.modulename] = set()
+        self.thread = threading.get_ident()
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.record_import
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        builtins.__import__ = self.original_import
+
+    def record_import(self, name, globals = None, locals = None, fromlist = (), level = 0):
+        m = self.original_import(name, globals, locals, fromlist, level)
+
+        # Imports made meanwhile on other threads aren't part of the load
+        if threading.get_ident() != self.thread:
+            return m
+
+        importer = globals.get('__name__') if globals else None
+        if not importer:
+            return m
+
+        try:
+            if level > 0:
+                name = importlib.util.resolve_name('.' * level + name,
+                    globals.get('__package__') or importer)
+        except (ValueError, ImportError):
+            return m
+
+        imported = module_imports.setdefault(importer, set())
+        imported.add(name)
+        for item in fromlist or ():
+            imported.add(name + '.' + item)
+
+        return m
+
+def dependent_modules(modulename):
+    """
+    Returns the loaded modules that directly or indirectly imported
+    modulename, ordered so each comes after the modules it imports
+    """
+    importers = {}
+    for importer, imported in list(module_imports.items()):
+        for name in imported:
+            importers.setdefault(name, set()).add(importer)
+
+    dependents = set()
+    stack = [modulename]
+    while stack:
+        for importer in importers.get(stack.pop(), ()):
+            if importer not in dependents and importer != modulename and importer in sys.modules:
+                dependents.add(importer)
+                stack.append(importer)
+
+    ordered = []
+    visited = set()
+
+    def visit(name):
+        if name in visited:
+            return
+        visited.add(name)
+        for dep in sorted(module_imports.get(name, ())):
+            if dep in dependents:
+                visit(dep)
+        ordered.append(name)
+
+    for name in sorted(dependents):
+        visit(name)
+
+    return ordered
+
+def load_plugin(modulename, reload_existing = True, synthesize_activated = True):
+    with trace_span(modulename, "import"), import_recorder(modulename):
+        if modulename in sys.modules and reload_existing:
+            m = sys.modules[modulename]
+            unload_module(m)
+            # Stop dispatching to the old plugins now, the reload may fail
+            rebuild_dispatch_tables()
+            m = imp.reload(m)
+        elif modulename in sys.modules:
+            m = sys.modules[modulename]
+        else:
+            m = importlib.import_module(modulename)
+
+    plugin_module_names.add(modulename)
 
     module_plugins = []
     on_activated_targets = []
@@ -79,13 +1244,16 @@ def reload_plugin(modulename):
             if t.__bases__:
                 is_plugin = False
                 if issubclass(t, ApplicationCommand):
-                    application_command_classes.append(t)
+                    register_command_class(modulename, t,
+                        application_command_classes, application_commands_by_name)
                     is_plugin = True
                 if issubclass(t, WindowCommand):
-                    window_command_classes.append(t)
+                    register_command_class(modulename, t,
+                        window_command_classes, window_commands_by_name)
                     is_plugin = True
                 if issubclass(t, TextCommand):
-                    text_command_classes.append(t)
+                    register_command_class(modulename, t,
+                        text_command_classes, text_commands_by_name)
                     is_plugin = True
 
                 if is_plugin:
@@ -93,11 +1261,9 @@ def reload_plugin(modulename):
 
                 if issubclass(t, EventListener):
                     obj = t()
-                    for p in all_callbacks.items():
-                        if p[0] in dir(obj):
-                            p[1].append(obj)
+                    register_listener(modulename, obj)
 
-                    if "on_activated" in dir(obj):
+                    if synthesize_activated and hasattr(obj, "on_activated"):
                         on_activated_targets.append(obj)
 
                     module_plugins.append(obj)
@@ -108,12 +1274,18 @@ def reload_plugin(modulename):
     if len(module_plugins) > 0:
         m.plugins = module_plugins
 
+    rebuild_dispatch_tables()
+    record_manifest_entry(m, module_plugins)
+
     if api_ready:
+        save_plugin_manifest()
+
         if "plugin_loaded" in m.__dict__:
-            try:
-                m.plugin_loaded()
-            except:
-                traceback.print_exc()
+            with trace_span(modulename, "plugin_loaded"):
+                try:
+                    m.plugin_loaded()
+                except:
+                    traceback.print_exc()
 
         # Synthesize any required on_activated calls
         for el in on_activated_targets:
@@ -126,6 +1298,165 @@ def reload_plugin(modulename):
                     except:
                         traceback.print_exc()
 
+    return m
+
+# Lazy loading. The command names and implemented events of every loaded
+# plugin module are cached in a manifest. On the next start, a module whose
+# source is unchanged is registered from the manifest with placeholder
+# commands and listeners, and only imported once one of them is used
+lazy_loading = True
+
+# Bumped whenever the layout of manifest entries changes, older manifests
+# are discarded
+plugin_manifest_version = 3
+plugin_manifest = None
+plugin_manifest_dirty = False
+
+deferred_modules = {}
+
+def plugin_manifest_path():
+    return os.path.join(sublime.cache_path(), "plugin_manifest.json")
+
+def load_plugin_manifest():
+    global plugin_manifest
+
+    if plugin_manifest is None:
+        plugin_manifest = {}
+        try:
+            with open(plugin_manifest_path(), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if (isinstance(manifest, dict) and
+                    manifest.get('version') == plugin_manifest_version):
+                plugin_manifest = manifest['modules']
+        except (IOError, OSError, ValueError):
+            pass
+
+    return plugin_manifest
+
+def save_plugin_manifest():
+    global plugin_manifest_dirty
+
+    if not plugin_manifest_dirty:
+        return
+
+    path = plugin_manifest_path()
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': plugin_manifest_version,
+                'modules': plugin_manifest}, f)
+        os.replace(tmp_path, path)
+        plugin_manifest_dirty = False
+    except (IOError, OSError):
+        traceback.print_exc()
+
+def module_source_path(m):
+    loader = getattr(m, '__loader__', None)
+    if isinstance(loader, ZipLoader):
+        return loader.path
+    return getattr(m, '__file__', None)
+
+def source_stamp(path):
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [path, st.st_mtime, st.st_size]
+
+def is_lazy_loadable(m, module_plugins):
+    if not module_plugins:
+        return False
+
+    for hook in ("plugin_loaded", "plugin_unloaded", "unload_handler"):
+        if hook in m.__dict__:
+            return False
+
+    # Placeholders have to know the command names without instantiating the
+    # command, which isn't possible if name() is overridden
+    for p in module_plugins:
+        if isinstance(p, type) and p.name is not Command.name:
+            return False
+
+    return True
+
+def record_manifest_entry(m, module_plugins):
+    global plugin_manifest_dirty
+
+    manifest = load_plugin_manifest()
+    stamp = source_stamp(module_source_path(m))
+    if stamp is None or not is_lazy_loadable(m, module_plugins):
+        if manifest.pop(m.__name__, None) is not None:
+            plugin_manifest_dirty = True
+        return
+
+    entry = {
+        'stamp': stamp,
+        'application_commands': [],
+        'window_commands': [],
+        'text_commands': [],
+        'listeners': []}
+
+    for p in module_plugins:
+        if not isinstance(p, type):
+            events = sorted(name for name in all_callbacks if hasattr(p, name))
+            context_keys = p.context_keys
+            if context_keys is not None:
+                context_keys = sorted(context_keys)
+            command_names = p.command_names
+            if command_names is not None:
+                command_names = sorted(command_names)
+            entry['listeners'].append([p.__class__.__name__, events,
+                context_keys, command_names])
+            continue
+
+        cmd = [p.__name__, class_command_name(p)]
+        if issubclass(p, ApplicationCommand):
+            entry['application_commands'].append(cmd)
+        if issubclass(p, WindowCommand):
+            entry['window_commands'].append(cmd)
+        if issubclass(p, TextCommand):
+            entry['text_commands'].append(cmd)
+
+    if manifest.get(m.__name__) != entry:
+        manifest[m.__name__] = entry
+        plugin_manifest_dirty = True
+
+def defer_plugin(modulename):
+    entry = load_plugin_manifest().get(modulename)
+    if not entry:
+        return False
+
+    path = entry['stamp'][0]
+    if source_stamp(path) != entry['stamp']:
+        return False
+
+    # A loose file overriding a module from a .sublime-package takes
+    # precedence over the archive the manifest was built from
+    if not path.endswith(".py"):
+        override = os.path.join(sublime.packages_path(),
+            *modulename.split('.')) + ".py"
+        if os.path.exists(override):
+            return False
+
+    deferred = DeferredModule(modulename, entry)
+    deferred.register()
+    deferred_modules[modulename] = deferred
+    rebuild_dispatch_tables()
+    return True
+
+def load_deferred_module(modulename):
+    """ Imports a deferred plugin module, returning the module """
+    with plugin_lock:
+        deferred = deferred_modules.pop(modulename, None)
+        if deferred:
+            print("loading deferred plugin", modulename)
+            deferred.unregister()
+            # The placeholders forward the event that triggered the import,
+            # on_activated included
+            return load_plugin(modulename, False, False)
+
+    return sys.modules[modulename]
+
 def create_application_commands():
     cmds = []
     for class_ in application_command_classes:
@@ -133,29 +1464,84 @@ def create_application_commands():
     sublime_api.notify_application_commands(cmds)
 
 def create_window_commands(window_id):
-    window = sublime.Window(window_id)
+    window = sublime.interned_window(window_id)
     cmds = []
     for class_ in window_command_classes:
         cmds.append(class_(window))
     return cmds
 
 def create_text_commands(view_id):
-    view = sublime.View(view_id)
-    cmds = []
-    for class_ in text_command_classes:
-        cmds.append(class_(view))
-    return cmds
+    return [TextCommandHandle(class_, view_id) for class_ in text_command_classes]
+
+# view_id -> {command class: TextCommand}, filled in by TextCommandHandle as
+# commands are used, and dropped when the view is closed
+text_command_instances = {}
+
+class TextCommandHandle(object):
+    """
+    Stands in for a TextCommand of a view, creating the actual instance the
+    first time the command is run or queried
+    """
+    __slots__ = ('command_class', 'view_id')
+
+    def __init__(self, command_class, view_id):
+        self.command_class = command_class
+        self.view_id = view_id
+
+    def instance(self):
+        cmds = text_command_instances.get(self.view_id)
+        if cmds is None:
+            cmds = text_command_instances.setdefault(self.view_id, {})
+
+        cmd = cmds.get(self.command_class)
+        if cmd is None:
+            cmd = self.command_class(sublime.interned_view(self.view_id))
+            cmds[self.command_class] = cmd
+        return cmd
+
+    def name(self):
+        name = class_command_name(self.command_class)
+        if name is None:
+            name = self.instance().name()
+        return name
+
+    def run_(self, edit_token, args):
+        return self.instance().run_(edit_token, args)
+
+    def is_enabled_(self, args):
+        return self.instance().is_enabled_(args)
+
+    def is_visible_(self, args):
+        return self.instance().is_visible_(args)
+
+    def is_checked_(self, args):
+        return self.instance().is_checked_(args)
 
+    def description_(self, args):
+        return self.instance().description_(args)
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
+
+@recorded
 def on_api_ready():
     global api_ready
     api_ready = True
 
+    save_plugin_manifest()
+
     for m in list(sys.modules.values()):
         if "plugin_loaded" in m.__dict__:
-            try:
-                m.plugin_loaded()
-            except:
-                traceback.print_exc()
+            with trace_span(m.__name__, "plugin_loaded"):
+                try:
+                    m.plugin_loaded()
+                except:
+                    traceback.print_exc()
+
+    write_startup_trace()
+
+    if stall_threshold_ms > 0 and stall_watchdog is None:
+        set_stall_watchdog(stall_threshold_ms)
 
     # Synthesize an on_activated call
     w = sublime.active_window()
@@ -163,175 +1549,176 @@ def on_api_ready():
         view_id = sublime_api.window_active_view(w.window_id)
         if view_id != 0:
             try:
-                on_activated(view_id)
+                # Not through on_activated, so event traces only hold calls
+                # made by the application
+                run_view_callbacks('on_activated', view_id)
             except:
                 traceback.print_exc()
 
-def on_new(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_new']:
+def run_view_callbacks(name, view_id):
+    v = sublime.interned_view(view_id)
+    for callback in dispatch_tables[name]:
         try:
-            callback.on_new(v)
+            callback(v)
         except:
             traceback.print_exc()
 
-def on_new_async(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_new_async']:
+def run_view_batch_callbacks(name, view_ids):
+    views = [sublime.interned_view(view_id) for view_id in view_ids]
+    per_view, batch = batch_tables[name]
+
+    for v in views:
+        for callback in per_view:
+            try:
+                callback(v)
+            except:
+                traceback.print_exc()
+
+    for callback in batch:
         try:
-            callback.on_new_async(v)
+            callback(views)
         except:
             traceback.print_exc()
 
+@recorded
+@watch_stalls
+def on_new(view_id):
+    run_view_callbacks('on_new', view_id)
+
+@recorded
+def on_new_async(view_id):
+    run_view_callbacks('on_new_async', view_id)
+
+@recorded
+@watch_stalls
 def on_clone(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_clone']:
-        try:
-            callback.on_clone(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_clone', view_id)
 
+@recorded
 def on_clone_async(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_clone_async']:
-        try:
-            callback.on_clone_async(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_clone_async', view_id)
 
+@recorded
+@watch_stalls
 def on_load(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_load']:
-        try:
-            callback.on_load(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_load', view_id)
 
+@recorded
 def on_load_async(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_load_async']:
-        try:
-            callback.on_load_async(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_load_async', view_id)
+
+@recorded
+@watch_stalls
+def on_new_batch(view_ids):
+    run_view_batch_callbacks('on_new', view_ids)
+
+@recorded
+def on_new_batch_async(view_ids):
+    run_view_batch_callbacks('on_new_async', view_ids)
+
+@recorded
+@watch_stalls
+def on_clone_batch(view_ids):
+    run_view_batch_callbacks('on_clone', view_ids)
+
+@recorded
+def on_clone_batch_async(view_ids):
+    run_view_batch_callbacks('on_clone_async', view_ids)
 
+@recorded
+@watch_stalls
+def on_load_batch(view_ids):
+    run_view_batch_callbacks('on_load', view_ids)
+
+@recorded
+def on_load_batch_async(view_ids):
+    run_view_batch_callbacks('on_load_async', view_ids)
+
+@recorded
+@watch_stalls
 def on_pre_close(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_pre_close']:
-        try:
-            callback.on_pre_close(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_pre_close', view_id)
 
+@recorded
+@watch_stalls
 def on_close(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_close']:
-        try:
-            callback.on_close(v)
-        except:
-            traceback.print_exc()
-
+    run_view_callbacks('on_close', view_id)
+    sublime.forget_view(view_id)
+    text_command_instances.pop(view_id, None)
+    selection_generations.pop(view_id, None)
+
+    for table in dispatch_tables.values():
+        for callback in table:
+            if isinstance(callback, (CoalescedCallback, CachedCompletions)):
+                callback.forget_view(view_id)
+
+@recorded
+@watch_stalls
 def on_pre_save(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_pre_save']:
-        try:
-            callback.on_pre_save(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_pre_save', view_id)
 
+@recorded
 def on_pre_save_async(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_pre_save_async']:
-        try:
-            callback.on_pre_save_async(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_pre_save_async', view_id)
 
+@recorded
+@watch_stalls
 def on_post_save(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_post_save']:
-        try:
-            callback.on_post_save(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_post_save', view_id)
 
+@recorded
 def on_post_save_async(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_post_save_async']:
-        try:
-            callback.on_post_save_async(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_post_save_async', view_id)
 
+@recorded
+@watch_stalls
 def on_modified(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_modified']:
-        try:
-            callback.on_modified(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_modified', view_id)
 
+@recorded
 def on_modified_async(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_modified_async']:
-        try:
-            callback.on_modified_async(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_modified_async', view_id)
 
+# view_id -> number of selection changes seen, used to invalidate cached
+# command query results
+selection_generations = {}
+
+@recorded
+@watch_stalls
 def on_selection_modified(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_selection_modified']:
-        try:
-            callback.on_selection_modified(v)
-        except:
-            traceback.print_exc()
+    selection_generations[view_id] = selection_generations.get(view_id, 0) + 1
+    run_view_callbacks('on_selection_modified', view_id)
 
+@recorded
 def on_selection_modified_async(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_selection_modified_async']:
-        try:
-            callback.on_selection_modified_async(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_selection_modified_async', view_id)
 
+@recorded
+@watch_stalls
 def on_activated(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_activated']:
-        try:
-            callback.on_activated(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_activated', view_id)
 
+@recorded
 def on_activated_async(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_activated_async']:
-        try:
-            callback.on_activated_async(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_activated_async', view_id)
 
+@recorded
+@watch_stalls
 def on_deactivated(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_deactivated']:
-        try:
-            callback.on_deactivated(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_deactivated', view_id)
 
+@recorded
 def on_deactivated_async(view_id):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_deactivated_async']:
-        try:
-            callback.on_deactivated_async(v)
-        except:
-            traceback.print_exc()
+    run_view_callbacks('on_deactivated_async', view_id)
 
+@recorded
+@watch_stalls
 def on_query_context(view_id, key, operator, operand, match_all):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_query_context']:
+    v = sublime.interned_view(view_id)
+    index, fallback = context_key_index
+    for callback in index.get(key, fallback):
         try:
-            val = callback.on_query_context(v, key, operator, operand, match_all)
+            val = callback(v, key, operator, operand, match_all)
             if val:
                 return True
         except:
@@ -339,6 +1726,45 @@ def on_query_context(view_id, key, operator, operand, match_all):
 
     return False
 
+# The merged completions are de-duplicated by trigger, candidates that
+# can't match the prefix are dropped, and only the completion_limit best
+# matches are passed on. 0 means no limit
+completion_limit = 500
+
+def completion_trigger(c):
+    # Anything after a tab is a hint shown next to the trigger
+    return c[0].split('\t', 1)[0]
+
+def completion_score(prefix, prefix_lower, trigger):
+    if trigger.startswith(prefix):
+        return 3
+    if trigger.lower().startswith(prefix_lower):
+        return 2
+    if fuzzy_match(prefix, trigger):
+        return 1
+    return 0
+
+def rank_completions(completions, prefix):
+    seen = set()
+    candidates = []
+    prefix_lower = prefix.lower()
+    for c in completions:
+        trigger = completion_trigger(c)
+        if trigger in seen:
+            continue
+        seen.add(trigger)
+
+        score = completion_score(prefix, prefix_lower, trigger) if prefix else 1
+        if score > 0:
+            candidates.append((-score, len(candidates), c))
+
+    if completion_limit > 0 and len(candidates) > completion_limit:
+        candidates = heapq.nsmallest(completion_limit, candidates)
+        # Keep the providers' order for the candidates that made the cut
+        candidates.sort(key=lambda x: x[1])
+
+    return [c for score, i, c in candidates]
+
 def normalise_completion(c):
     if len(c) == 1:
         return (c[0], "", "")
@@ -347,30 +1773,115 @@ def normalise_completion(c):
     else:
         return c
 
-def on_query_completions(view_id, prefix, locations):
-    v = sublime.View(view_id)
+# When completion_workers is above zero, completion providers are queried
+# concurrently on a thread pool, and those that haven't answered within
+# completion_deadline_ms are left out of the result
+completion_workers = 0
+completion_deadline_ms = 50
+completion_executor = None
+
+# (listener name, callback) for each on_query_completions listener
+completion_providers = ()
+
+# listener name -> number of completion requests it missed the deadline for
+late_completion_providers = {}
+
+# listener name -> future of its last query. A running call can't be
+# cancelled, so a provider isn't queried again until it has returned
+completion_futures = {}
+
+def note_late_provider(name):
+    count = late_completion_providers.get(name, 0)
+    late_completion_providers[name] = count + 1
+    if count == 0:
+        print("completions from", name, "missed the",
+            completion_deadline_ms, "ms deadline")
+
+def set_completion_workers(workers, deadline_ms = None):
+    global completion_workers, completion_deadline_ms, completion_executor
+
+    if completion_executor is not None:
+        completion_executor.shutdown(wait=False)
+        completion_executor = None
+    completion_futures.clear()
+
+    completion_workers = workers
+    if deadline_ms is not None:
+        completion_deadline_ms = deadline_ms
+
+def query_completions_concurrently(v, prefix, locations):
+    global completion_executor
+
+    if completion_executor is None:
+        completion_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=completion_workers)
+
+    pending = []
+    for name, callback in completion_providers:
+        previous = completion_futures.get(name)
+        if previous is not None and not previous.done():
+            note_late_provider(name)
+            continue
+
+        f = completion_executor.submit(callback, v, prefix, locations)
+        completion_futures[name] = f
+        pending.append((name, f))
+
+    concurrent.futures.wait([f for name, f in pending],
+        timeout=completion_deadline_ms / 1000.0)
+
+    results = []
+    for name, f in pending:
+        if not f.done():
+            f.cancel()
+            note_late_provider(name)
+            continue
 
-    completions = []
-    flags = 0
-    for callback in all_callbacks['on_query_completions']:
         try:
-            res = callback.on_query_completions(v, prefix, locations)
-
-            if isinstance(res, tuple):
-                completions += [normalise_completion(c) for c in res[0]]
-                flags |= res[1]
-            elif isinstance(res, list):
-                completions += [normalise_completion(c) for c in res]
+            results.append(f.result())
         except:
             traceback.print_exc()
 
-    return (completions,flags)
+    return results
+
+@recorded
+@watch_stalls
+def on_query_completions(view_id, prefix, locations):
+    v = sublime.interned_view(view_id)
+
+    if completion_workers > 0:
+        results = query_completions_concurrently(v, prefix, locations)
+    else:
+        results = []
+        for callback in dispatch_tables['on_query_completions']:
+            try:
+                results.append(callback(v, prefix, locations))
+            except:
+                traceback.print_exc()
 
+    completions = []
+    flags = 0
+    for res in results:
+        if isinstance(res, tuple):
+            completions += [normalise_completion(c) for c in res[0]]
+            flags |= res[1]
+        elif isinstance(res, list):
+            completions += [normalise_completion(c) for c in res]
+
+    return (rank_completions(completions, prefix), flags)
+
+@recorded
+@watch_stalls
 def on_text_command(view_id, name, args):
-    v = sublime.View(view_id)
-    for callback in all_callbacks['on_text_command']:
+    index, fallback = text_command_index
+    callbacks = index.get(name, fallback)
+    if not callbacks:
+        return ("", None)
+
+    v = sublime.interned_view(view_id)
+    for callback in callbacks:
         try:
-            res = callback.on_text_command(v, name, args)
+            res = callback(v, name, args)
             if isinstance(res, tuple):
                 return res
             elif res:
@@ -380,11 +1891,18 @@ def on_text_command(view_id, name, args):
 
     return ("", None)
 
+@recorded
+@watch_stalls
 def on_window_command(window_id, name, args):
-    window = sublime.Window(window_id)
-    for callback in all_callbacks['on_window_command']:
+    index, fallback = window_command_index
+    callbacks = index.get(name, fallback)
+    if not callbacks:
+        return ("", None)
+
+    window = sublime.interned_window(window_id)
+    for callback in callbacks:
         try:
-            res = callback.on_window_command(window, name, args)
+            res = callback(window, name, args)
             if isinstance(res, tuple):
                 return res
             elif res:
@@ -394,34 +1912,59 @@ def on_window_command(window_id, name, args):
 
     return ("", None)
 
+def class_command_name(cls):
+    """
+    Returns the command name of cls, derived from the class name. Returns
+    None for classes that override name(), as only an instance can tell
+    """
+    name = command_names.get(cls)
+    if name is not None:
+        return name
+
+    if cls.name is not Command.name:
+        # Deferred placeholders carry the name of the command they stand in for
+        name = getattr(cls, 'command_name', None)
+        if name is not None:
+            command_names[cls] = name
+        return name
+
+    name = derived_command_name(cls)
+    command_names[cls] = name
+    return name
+
+def derived_command_name(cls):
+    clsname = cls.__name__
+    name = clsname[0].lower()
+    last_upper = False
+    for c in clsname[1:]:
+        if c.isupper() and not last_upper:
+            name += '_'
+            name += c.lower()
+        else:
+            name += c
+        last_upper = c.isupper()
+    if name.endswith("_command"):
+        name = name[0:-8]
+    return name
+
 class Command(object):
     def name(self):
-        clsname = self.__class__.__name__
-        name = clsname[0].lower()
-        last_upper = False
-        for c in clsname[1:]:
-            if c.isupper() and not last_upper:
-                name += '_'
-                name += c.lower()
-            else:
-                name += c
-            last_upper = c.isupper()
-        if name.endswith("_command"):
-            name = name[0:-8]
+        name = command_names.get(self.__class__)
+        if name is None:
+            name = class_command_name(self.__class__)
+            if name is None:
+                # Reached through super() from an overriding name()
+                name = derived_command_name(self.__class__)
         return name
 
+    def query_(self, method, args):
+        return call_query_method(self, method, args)
+
     def is_enabled_(self, args):
-        ret = None
-        try:
-            if args:
-                if 'event' in args:
-                    del args['event']
+        if args and 'event' in args:
+            del args['event']
 
-                ret = self.is_enabled(**args)
-            else:
-                ret = self.is_enabled()
-        except TypeError:
-            ret = self.is_enabled()
+        ret = self.query_('is_enabled', args)
 
         if not isinstance(ret, bool):
             raise ValueError("is_enabled must return a bool", self)
@@ -432,14 +1975,7 @@ class Command(object):
         return True
 
     def is_visible_(self, args):
-        ret = None
-        try:
-            if args:
-                ret = self.is_visible(**args)
-            else:
-                ret = self.is_visible()
-        except TypeError:
-            ret = self.is_visible()
+        ret = self.query_('is_visible', args)
 
         if not isinstance(ret, bool):
             raise ValueError("is_visible must return a bool", self)
@@ -450,14 +1986,7 @@ class Command(object):
         return True
 
     def is_checked_(self, args):
-        ret = None
-        try:
-            if args:
-                ret = self.is_checked(**args)
-            else:
-                ret = self.is_checked()
-        except TypeError:
-            ret = self.is_checked()
+        ret = self.query_('is_checked', args)
 
         if not isinstance(ret, bool):
             raise ValueError("is_checked must return a bool", self)
@@ -512,9 +2041,36 @@ class WindowCommand(Command):
 
 
 class TextCommand(Command):
+    # When True, is_enabled, is_visible and is_checked results are reused
+    # until the buffer or the selection of the view changes
+    cache_queries = False
+
     def __init__(self, view):
         self.view = view
 
+    def query_(self, method, args):
+        if not self.cache_queries:
+            return call_query_method(self, method, args)
+
+        state = (self.view.change_count(),
+            selection_generations.get(self.view.view_id, 0))
+        if self.__dict__.get('query_cache_state') != state:
+            self.query_cache_state = state
+            self.query_cache = {}
+
+        if args:
+            key = (method, repr(sorted(args.items())))
+        else:
+            key = (method, None)
+
+        try:
+            return self.query_cache[key]
+        except KeyError:
+            ret = call_query_method(self, method, args)
+            self.query_cache[key] = ret
+            return ret
+
+    @watch_stalls
     def run_(self, edit_token, args):
         if args:
             if 'event' in args:
@@ -537,79 +2093,459 @@ class TextCommand(Command):
 
 
 class EventListener(object):
+    # The context keys on_query_context handles, e.g., {"indented_block"}.
+    # None means the listener is asked about every key
+    context_keys = None
+
+    # The commands on_text_command and on_window_command intercept, e.g.,
+    # {"move", "drag_select"}. None means every command is passed on
+    command_names = None
+
+    # When True, on_query_completions results are cached per view, see
+    # CachedCompletions
+    cache_completions = False
+
+    # When True, the listener's completions don't depend on the prefix, so
+    # the cache may filter them as the prefix grows instead of asking again
+    completions_prefix_independent = False
+
+class DeferredModule(object):
+    """ Placeholder plugins for a module that hasn't been imported yet """
+    def __init__(self, modulename, entry):
+        self.modulename = modulename
+        self.plugins = []
+
+        for key, base, cmd_list, commands_by_name in (
+                ('application_commands', DeferredApplicationCommand,
+                    application_command_classes, application_commands_by_name),
+                ('window_commands', DeferredWindowCommand,
+                    window_command_classes, window_commands_by_name),
+                ('text_commands', DeferredTextCommand,
+                    text_command_classes, text_commands_by_name)):
+            for class_name, command_name in entry[key]:
+                t = type(class_name, (base,), {
+                    '__module__': modulename,
+                    'deferred_module': modulename,
+                    'deferred_class': class_name,
+                    'command_name': command_name})
+                self.plugins.append((t, (cmd_list, commands_by_name)))
+
+        for class_name, events, context_keys, command_names in entry['listeners']:
+            attrs = dict((e, deferred_event_handler(modulename, e)) for e in events)
+            attrs['__module__'] = modulename
+            if context_keys is not None:
+                attrs['context_keys'] = frozenset(context_keys)
+            if command_names is not None:
+                attrs['command_names'] = frozenset(command_names)
+            t = type(class_name, (DeferredEventListener,), attrs)
+            self.plugins.append((t(), None))
+
+    def register(self):
+        for p, cmd_lists in self.plugins:
+            if cmd_lists is not None:
+                register_command_class(self.modulename, p, *cmd_lists)
+            else:
+                register_listener(self.modulename, p)
+
+    def unregister(self):
+        unregister_plugins(self.modulename)
+
+class DeferredCommand(object):
+    deferred_module = None
+    deferred_class = None
+    command_name = None
+    target_ = None
+
+    def name(self):
+        return self.command_name
+
+    def target(self):
+        if self.target_ is None:
+            m = load_deferred_module(self.deferred_module)
+            cls = self.commands_by_name.get(self.command_name)
+            if (cls is None or cls.__module__ != self.deferred_module or
+                    issubclass(cls, DeferredCommand)):
+                cls = getattr(m, self.deferred_class)
+            self.target_ = cls(*self.target_args())
+        return self.target_
+
+    def run_(self, edit_token, args):
+        return self.target().run_(edit_token, args)
+
+    def is_enabled_(self, args):
+        return self.target().is_enabled_(args)
+
+    def is_visible_(self, args):
+        return self.target().is_visible_(args)
+
+    def is_checked_(self, args):
+        return self.target().is_checked_(args)
+
+    def description_(self, args):
+        return self.target().description_(args)
+
+class DeferredApplicationCommand(DeferredCommand, ApplicationCommand):
+    commands_by_name = application_commands_by_name
+
+    def target_args(self):
+        return ()
+
+class DeferredWindowCommand(DeferredCommand, WindowCommand):
+    commands_by_name = window_commands_by_name
+
+    def target_args(self):
+        return (self.window,)
+
+class DeferredTextCommand(DeferredCommand, TextCommand):
+    commands_by_name = text_commands_by_name
+
+    def target_args(self):
+        return (self.view,)
+
+class DeferredEventListener(EventListener):
     pass
 
+def deferred_event_handler(modulename, event):
+    def handler(self, *args):
+        m = load_deferred_module(modulename)
+
+        # Deliver the event that triggered the import to the real listener
+        # this placeholder stands in for. The other placeholders of the
+        # module may still be in the table being dispatched, and will
+        # forward to their own listeners
+        class_name = self.__class__.__name__
+        for p in getattr(m, 'plugins', []):
+            if (isinstance(p, EventListener) and
+                    p.__class__.__name__ == class_name and hasattr(p, event)):
+                return getattr(p, event)(*args)
+
+        return None
+
+    return handler
+
 class MultizipImporter(object):
     def __init__(self):
         self.loaders = []
+        # Package name -> loader, and archive path -> loader. When several
+        # loaders share a name or path, the first one wins
+        self.loaders_by_name = {}
+        self.loaders_by_path = {}
+
+    def set_loaders(self, loaders):
+        by_name = {}
+        by_path = {}
+        for l in loaders:
+            by_name.setdefault(l.name, l)
+            by_path.setdefault(l.path, l)
+
+        self.loaders_by_name = by_name
+        self.loaders_by_path = by_path
+        self.loaders = loaders
+
+    def find_loader_(self, fullname, path):
+        if not path:
+            return self.loaders_by_name.get(fullname)
+
+        path = list(path)
+        if len(path) == 1:
+            l = self.loaders_by_path.get(path[0])
+            if l and l.has(fullname):
+                return l
+
+        return None
 
     def find_module(self, fullname, path = None):
-        if not path:
-            for l in self.loaders:
-                if l.name == fullname:
-                    return l;
+        return self.find_loader_(fullname, path)
+
+    def find_spec(self, fullname, path = None, target = None):
+        l = self.find_loader_(fullname, path)
+        if l is None:
+            return None
+
+        # Not flagged as a package, so __package__ stays the parent package,
+        # as it always has been. exec_module sets __path__ itself
+        return ModuleSpec(fullname, l, origin=l.path + "/" + fullname)
+
+    def invalidate_caches(self):
+        pass
+
+
+# Code objects of modules loaded from .sublime-package files are cached in
+# this directory under the cache path, so they aren't recompiled on every
+# start. Entries are keyed by archive, member, archive mtime and size, and
+# interpreter magic number
+bytecode_cache_enabled = True
+bytecode_cache_dir_name = "Plugin Bytecode"
+
+try:
+    from importlib.util import MAGIC_NUMBER as bytecode_magic
+except ImportError:
+    bytecode_magic = imp.get_magic()
+
+def bytecode_cache_path(key):
+    return os.path.join(sublime.cache_path(), bytecode_cache_dir_name, key + ".pyc")
+
+def read_cached_code(path, header):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
 
-        for l in self.loaders:
-            if path == [l.path]:
-                if l.has(fullname):
-                    return l
+    if not data.startswith(header):
+        return None
 
+    try:
+        return marshal.loads(data[len(header):])
+    except (ValueError, EOFError, TypeError):
         return None
 
+def write_cached_code(path, header, code):
+    # Written under a name unique to this process and thread, then moved into
+    # place, so concurrent writers, e.g., several instances sharing the cache
+    # directory, never expose a partial file
+    tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(marshal.dumps(code))
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+# When True, each ZipLoader maps its archive into memory the first time a
+# member is read, instead of reading members through a file handle
+zip_mmap = False
 
 class ZipLoader(object):
     def __init__(self, path):
         self.path = path
         self.name = os.path.splitext(os.path.basename(path))[0]
+        self.mapped = None
+        self.lock = threading.Lock()
 
-        z = zipfile.ZipFile(path, 'r')
-        files = [i.filename for i in z.infolist()]
+        st = os.stat(path)
+        self.mtime = st.st_mtime
+        self.size = st.st_size
 
-        self.contents = {"":""}
+        # Module key -> (header offset, compressed size, compression method,
+        # flag bits, member name, CRC-32) of its source, or None for packages
+        # that only exist as a directory. Sources are read on demand, and
+        # checked against the CRC, as the archive may have been replaced
+        self.index = {"": None}
 
-        for f in files:
-            base, ext = os.path.splitext(f)
+        z = zipfile.ZipFile(path, 'r')
+        for info in z.infolist():
+            base, ext = os.path.splitext(info.filename)
             if ext != ".py":
                 continue
 
             paths = base.split('/')
 
-            self.contents['.'.join(paths)] = z.read(f).decode('utf-8')
+            self.index['.'.join(paths)] = (info.header_offset,
+                info.compress_size, info.compress_type, info.flag_bits,
+                info.filename, info.CRC)
 
             paths.pop()
             while len(paths) > 0:
-                self.contents['.'.join(paths)] = ""
+                self.index['.'.join(paths)] = None
                 paths.pop()
 
         z.close()
 
     def has(self, fullname):
         key = '.'.join(fullname.split('.')[1:])
-        return key in self.contents
+        return key in self.index
 
-    def load_module(self, fullname):
-        if fullname in sys.modules:
-            mod = sys.modules[fullname]
+    def is_current(self):
+        """ True if the archive is unchanged since the index was read """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        return st.st_mtime == self.mtime and st.st_size == self.size
+
+    def read_raw(self, offset, size):
+        if zip_mmap:
+            with self.lock:
+                if self.mapped is None:
+                    with open(self.path, 'rb') as f:
+                        self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.mapped[offset:offset + size]
+
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def read_member(self, member):
+        offset, compress_size, compress_type, flag_bits, filename, crc = member
+
+        if not self.is_current():
+            raise ImportError(self.path + " has changed since it was indexed")
+
+        # Encrypted members and unusual compression methods are left to zipfile
+        if flag_bits & 0x1 or compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            with zipfile.ZipFile(self.path, 'r') as z:
+                return z.read(filename)
+
+        if flag_bits & 0x800:
+            encoded_name = filename.encode('utf-8')
         else:
-            mod = sys.modules.setdefault(fullname, imp.new_module(fullname))
+            encoded_name = filename.encode('cp437')
+
+        header = self.read_raw(offset, 30 + len(encoded_name))
+        if (len(header) != 30 + len(encoded_name) or header[:4] != b'PK\x03\x04'
+                or header[30:] != encoded_name):
+            raise ImportError("bad local file header for " + filename + " in " + self.path)
+
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        data = self.read_raw(offset + 30 + name_len + extra_len, compress_size)
+
+        try:
+            if compress_type == zipfile.ZIP_DEFLATED:
+                data = zlib.decompress(data, -15)
+        except zlib.error:
+            raise ImportError("corrupt data for " + filename + " in " + self.path)
+
+        if zlib.crc32(data) & 0xffffffff != crc:
+            raise ImportError("CRC mismatch for " + filename + " in " + self.path)
+
+        return data
+
+    def source(self, key):
+        member = self.index[key]
+        if member is None:
+            return ""
+        return self.read_member(member).decode('utf-8')
+
+    def code(self, key, filename):
+        member = self.index[key]
+        if member is None or not bytecode_cache_enabled:
+            return compile(self.source(key), filename, 'exec', dont_inherit=True)
+
+        # The cache is keyed by the indexed stamp, so it can't vouch for a
+        # replaced archive
+        if not self.is_current():
+            raise ImportError(self.path + " has changed since it was indexed")
+
+        digest = self.bytecode_key(member)
+        header = bytecode_magic + digest.encode('ascii')
+        path = bytecode_cache_path(digest)
+
+        code = read_cached_code(path, header)
+        if code is None:
+            code = compile(self.source(key), filename, 'exec', dont_inherit=True)
+            write_cached_code(path, header, code)
+
+        return code
+
+    def bytecode_key(self, member):
+        return hashlib.sha1(repr((self.path, member[4], self.mtime,
+            self.size)).encode('utf-8') + bytecode_magic).hexdigest()
+
+    def bytecode_keys(self):
+        return [self.bytecode_key(m) for m in self.index.values() if m is not None]
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, mod):
+        fullname = mod.__name__
 
         mod.__file__ = self.path + "/" + fullname
-        mod.__name__ = fullname
         mod.__path__ = [self.path]
         mod.__loader__ = self
         mod.__package__ = '.'.join(fullname.split('.')[:-1])
 
         key = '.'.join(fullname.split('.')[1:])
-        source = self.contents[key]
+        code = self.code(key, mod.__file__)
 
-        if source == None:
-            file = '/'.join(fullname.split('.')[1:])
+        with trace_span(fullname, "exec"):
+            exec(code, mod.__dict__)
 
-        exec(source, mod.__dict__)
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            mod = sys.modules[fullname]
+        else:
+            mod = sys.modules.setdefault(fullname, imp.new_module(fullname))
+
+        mod.__name__ = fullname
+        self.exec_module(mod)
         return mod
 
 multi_importer = MultizipImporter()
 sys.meta_path.append(multi_importer)
 
+package_index_workers = 4
+
+# Archive path -> milliseconds taken to index it, for the archives indexed
+# by the last call to update_compressed_packages
+package_index_timings = {}
+
+def build_zip_loader(path):
+    start = time.perf_counter()
+    l = ZipLoader(path)
+    return l, (time.perf_counter() - start) * 1000.0
+
 def update_compressed_packages(pkgs):
-    multi_importer.loaders = [ZipLoader(p) for p in pkgs]
+    # Loaders of archives that haven't changed are kept, the rest are
+    # indexed concurrently
+    current = multi_importer.loaders_by_path
+    loaders = {}
+    changed = []
+    for p in pkgs:
+        l = current.get(p)
+        if l is not None and l.is_current():
+            loaders[p] = l
+        elif p not in changed:
+            changed.append(p)
+
+    package_index_timings.clear()
+    if changed:
+        workers = min(len(changed), package_index_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [(p, pool.submit(build_zip_loader, p)) for p in changed]
+            for p, f in futures:
+                try:
+                    loaders[p], package_index_timings[p] = f.result()
+                except:
+                    traceback.print_exc()
+
+        for p in changed:
+            if p in package_index_timings:
+                print("indexed", os.path.basename(p), "in %.1f ms" % package_index_timings[p])
+
+    removed = set(current) - set(loaders)
+    multi_importer.set_loaders([loaders[p] for p in pkgs if p in loaders])
+
+    if changed or removed:
+        prune_bytecode_cache(multi_importer.loaders)
+
+def prune_bytecode_cache(loaders):
+    """
+    Deletes the cached bytecode of archives that are no longer installed,
+    and of older versions of the installed ones
+    """
+    if not bytecode_cache_enabled:
+        return
+
+    live = set()
+    for l in loaders:
+        live.update(l.bytecode_keys())
+
+    folder = os.path.join(sublime.cache_path(), bytecode_cache_dir_name)
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return
+
+    for name in names:
+        if name.endswith(".pyc") and name[:-4] not in live:
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
@@ -0,0 +1,432 @@
+"""
+Replays an event trace recorded by sublime_plugin (see
+SUBLIME_PLUGIN_EVENT_TRACE) outside of Sublime Text, against a stand-in
+sublime_api, and reports how long the plugins took to handle each event:
+
+    python3 sublime_replay.py trace.jsonl --output timings.json
+    python3 sublime_replay.py trace.jsonl --baseline timings.json
+
+With --baseline, the exit status is 1 when any event got slower than the
+baseline by more than --tolerance. Timings of a run in which plugins raised
+exceptions aren't comparable, so such a run exits with status 2 unless
+--allow-errors is given.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+import types
+
+# Fixed results of the API functions that don't need any state
+stand_in_results = {
+    'version': '3000',
+    'platform': 'linux',
+    'architecture': 'x64',
+    'channel': 'dev',
+    'executable_path': '',
+    'windows': [1],
+    'active_window': 1,
+    'get_clipboard': '',
+    'find_resources': [],
+    'view_window': 1,
+    'view_file_name': '',
+    'view_get_name': '',
+    'view_size': 0,
+    'view_cached_substr': '',
+    'view_scope_name': '',
+    'view_match_selector': False,
+    'view_score_selector': 0,
+    'score_selector': 0,
+    'view_selection_size': 1,
+    'view_has_non_empty_selection_region': False,
+    'view_row_col': (0, 0),
+    'view_text_point': 0,
+    'view_is_loading': False,
+    'view_is_dirty': False,
+    'view_is_scratch': False,
+    'view_is_read_only': False,
+    'view_is_in_edit': False,
+    'view_begin_edit': None,
+    'view_lines': [],
+    'view_split_by_newlines': [],
+    'view_find_all': [],
+    'view_find_all_results': [],
+    'view_find_by_selector': [],
+    'view_get_regions': [],
+    'view_folded_regions': [],
+    'view_extract_completions': [],
+    'view_symbols': [],
+    'view_indexed_symbols': [],
+    'view_meta_info': None,
+    'view_command_history': ('', None, 0),
+    'view_indentation_level': 0,
+    'view_classify': 0,
+    'view_em_width': 8.0,
+    'view_line_height': 16.0,
+    'view_viewport_position': (0.0, 0.0),
+    'view_viewport_extents': (800.0, 600.0),
+    'view_layout_extents': (800.0, 600.0),
+    'view_text_to_layout': (0.0, 0.0),
+    'view_layout_to_text': 0,
+    'view_find_all_with_contents': [],
+    'view_selection_contains': False,
+    'view_is_folded': False,
+    'view_encoding': 'UTF-8',
+    'view_line_endings': 'Unix',
+    'view_get_status': '',
+    'view_get_overwrite_status': False,
+    'window_get_view_index': (0, 0),
+    'window_views_in_group': [],
+    'window_active_view_in_group': 0,
+    'window_transient_view_in_group': 0,
+    'window_get_layout': {'cols': [0.0, 1.0], 'rows': [0.0, 1.0], 'cells': [[0, 0, 1, 1]]},
+    'window_folders': [],
+    'window_num_groups': 1,
+    'window_active_group': 0,
+    'window_get_project_data': None,
+    'window_project_file_name': '',
+    'window_lookup_symbol': [],
+    'window_lookup_symbol_in_open_files': [],
+}
+
+# API functions returning a Region, answered with an empty one at 0
+stand_in_region_results = frozenset([
+    'view_line_from_point', 'view_line_from_region',
+    'view_full_line_from_point', 'view_full_line_from_region',
+    'view_word_from_point', 'view_word_from_region',
+    'view_visible_region', 'view_expand_by_class', 'view_extract_scope',
+    'view_indented_region', 'view_find', 'view_find_by_class'])
+
+class StandInApi(types.ModuleType):
+    """
+    In-memory replacement for the sublime_api module. Views and windows have
+    no content, settings are plain dicts, and timeouts are queued until
+    run_timeouts() is called. Functions it doesn't know about return None
+    """
+    def __init__(self, packages_path, cache_path):
+        types.ModuleType.__init__(self, 'sublime_api')
+        self.packages_path_ = packages_path
+        self.cache_path_ = cache_path
+        self.settings = {}
+        self.settings_ids = {}
+        self.view_ids = []
+        self.active_view = 0
+        self.change_counts = {}
+        self.timeouts = []
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        if name in stand_in_results:
+            value = stand_in_results[name]
+            return lambda *args: value
+
+        if name in stand_in_region_results:
+            import sublime
+            return lambda *args: sublime.Region(0, 0)
+
+        return lambda *args: None
+
+    def packages_path(self):
+        return self.packages_path_
+
+    def installed_packages_path(self):
+        return os.path.join(self.cache_path_, "Installed Packages")
+
+    def cache_path(self):
+        return self.cache_path_
+
+    def log_message(self, msg):
+        sys.__stdout__.write(msg)
+
+    def set_timeout(self, callback, delay):
+        self.timeouts.append(callback)
+
+    def set_timeout_async(self, callback, delay):
+        self.timeouts.append(callback)
+
+    def run_timeouts(self, limit = 1000):
+        # Callbacks that keep rescheduling themselves are cut off at limit
+        count = 0
+        while self.timeouts and count < limit:
+            callback = self.timeouts.pop(0)
+            count += 1
+            try:
+                callback()
+            except:
+                errors.print_exc()
+
+    def settings_for(self, key):
+        settings_id = self.settings_ids.get(key)
+        if settings_id is None:
+            settings_id = len(self.settings_ids) + 1
+            self.settings_ids[key] = settings_id
+            self.settings[settings_id] = {}
+        return settings_id
+
+    def load_settings(self, name):
+        return self.settings_for(('file', name))
+
+    def view_settings(self, view_id):
+        return self.settings_for(('view', view_id))
+
+    def window_settings(self, window_id):
+        return self.settings_for(('window', window_id))
+
+    def window_template_settings(self, window_id):
+        return self.settings_for(('template', window_id))
+
+    def settings_get(self, settings_id, key):
+        return self.settings[settings_id].get(key)
+
+    def settings_get_default(self, settings_id, key, default):
+        return self.settings[settings_id].get(key, default)
+
+    def settings_has(self, settings_id, key):
+        return key in self.settings[settings_id]
+
+    def settings_set(self, settings_id, key, value):
+        self.settings[settings_id][key] = value
+
+    def settings_erase(self, settings_id, key):
+        self.settings[settings_id].pop(key, None)
+
+    def window_views(self, window_id):
+        return list(self.view_ids)
+
+    def window_active_view(self, window_id):
+        return self.active_view
+
+    def view_buffer_id(self, view_id):
+        return view_id
+
+    def view_change_count(self, view_id):
+        return self.change_counts.get(view_id, 0)
+
+    def view_selection_get(self, view_id, index):
+        import sublime
+        if index == 0:
+            return sublime.Region(0, 0)
+        return sublime.Region(-1, -1)
+
+    def note_event(self, name, args):
+        """ Updates the view state the way the application would before name """
+        if name.endswith('_batch') or name.endswith('_batch_async'):
+            view_ids = args[0]
+        elif name.startswith('on_window_command') or not args:
+            view_ids = []
+        else:
+            view_ids = [args[0]]
+
+        for view_id in view_ids:
+            if view_id not in self.change_counts:
+                self.change_counts[view_id] = 0
+                self.view_ids.append(view_id)
+
+        if name == 'on_modified':
+            self.change_counts[args[0]] += 1
+        elif name == 'on_activated':
+            self.active_view = args[0]
+
+    def note_closed(self, view_id):
+        if view_id in self.change_counts:
+            del self.change_counts[view_id]
+            self.view_ids.remove(view_id)
+        if self.active_view == view_id:
+            self.active_view = 0
+
+class ErrorCounter(object):
+    """
+    Stands in for the traceback module inside sublime_plugin, whose
+    dispatchers print and swallow the exceptions of plugins, to count them
+    """
+    def __init__(self):
+        self.count = 0
+
+    def print_exc(self, *args, **kwargs):
+        self.count += 1
+        traceback.print_exc(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(traceback, name)
+
+errors = ErrorCounter()
+
+def read_trace(path):
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                events.append((entry[1], entry[2:]))
+    return events
+
+def package_modules(packages_path):
+    """ The plugin modules the application would load: the top level .py
+    files of each package """
+    modules = []
+    for pkg in sorted(os.listdir(packages_path)):
+        pkg_path = os.path.join(packages_path, pkg)
+        if not os.path.isdir(pkg_path) or pkg == "User":
+            continue
+        for name in sorted(os.listdir(pkg_path)):
+            if name.endswith(".py"):
+                modules.append(pkg + "." + name[:-3])
+
+    if os.path.isdir(os.path.join(packages_path, "User")):
+        for name in sorted(os.listdir(os.path.join(packages_path, "User"))):
+            if name.endswith(".py"):
+                modules.append("User." + name[:-3])
+
+    return modules
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))
+    return sorted_values[index]
+
+def summarise(timings):
+    summary = {}
+    for name, values in timings.items():
+        values.sort()
+        total = sum(values)
+        summary[name] = {
+            'count': len(values),
+            'total_ms': total,
+            'mean_ms': total / len(values),
+            'p50_ms': percentile(values, 50),
+            'p99_ms': percentile(values, 99),
+            'max_ms': values[-1]}
+    return summary
+
+def replay(events, api, sublime_plugin, repeat = 1):
+    """ Dispatches the events repeat times, returning dispatcher -> [ms] """
+    timings = {}
+    clock = time.perf_counter
+
+    for i in range(repeat):
+        for name, args in events:
+            if name == 'on_api_ready' and i > 0:
+                continue
+
+            dispatcher = getattr(sublime_plugin, name, None)
+            if dispatcher is None:
+                print("unknown event in trace:", name)
+                continue
+
+            api.note_event(name, args)
+
+            start = clock()
+            try:
+                dispatcher(*args)
+            except:
+                errors.print_exc()
+            timings.setdefault(name, []).append((clock() - start) * 1000.0)
+
+            start = clock()
+            api.run_timeouts()
+            elapsed = (clock() - start) * 1000.0
+            if elapsed > 0.0:
+                timings.setdefault('timeouts', []).append(elapsed)
+
+            if name == 'on_close':
+                api.note_closed(args[0])
+
+    return timings
+
+def format_summary(summary):
+    header = "%10s %8s %10s %10s %10s  %s" % (
+        "total ms", "calls", "mean ms", "p99 ms", "max ms", "event")
+    lines = [header, "-" * len(header)]
+    for name, s in sorted(summary.items(), key=lambda i: i[1]['total_ms'], reverse=True):
+        lines.append("%10.1f %8d %10.3f %10.2f %10.2f  %s" % (
+            s['total_ms'], s['count'], s['mean_ms'], s['p99_ms'], s['max_ms'], name))
+    return "\n".join(lines) + "\n"
+
+def regressions(summary, baseline, tolerance, min_total_ms = 1.0):
+    """ Events whose total time grew by more than tolerance over baseline.
+    Events below min_total_ms in both runs are too noisy to compare """
+    found = []
+    for name, s in sorted(summary.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if max(s['total_ms'], before['total_ms']) < min_total_ms:
+            continue
+        if s['total_ms'] > before['total_ms'] * (1.0 + tolerance):
+            found.append((name, before['total_ms'], s['total_ms']))
+    return found
+
+def main(argv = None):
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="Replay a sublime_plugin event trace")
+    parser.add_argument('trace')
+    parser.add_argument('--packages', default=os.path.join(here, "Packages"),
+        help="folder holding the packages to load")
+    parser.add_argument('--plugins', default=None,
+        help="comma separated plugin modules to load, instead of every package")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', help="write the timings as JSON to this file")
+    parser.add_argument('--baseline', help="timings JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--allow-errors', action='store_true',
+        help="report and compare timings even if plugins raised exceptions")
+    args = parser.parse_args(argv)
+
+    # Never record the replay itself
+    os.environ.pop("SUBLIME_PLUGIN_EVENT_TRACE", None)
+
+    api = StandInApi(os.path.abspath(args.packages), tempfile.mkdtemp())
+    sys.modules['sublime_api'] = api
+    sys.path[:0] = [here, api.packages_path_]
+
+    import sublime_plugin
+    sublime_plugin.traceback = errors
+
+    # Demotion and the watchdog would change what gets measured
+    sublime_plugin.set_listener_budget(budget_ms=0)
+    sublime_plugin.stall_threshold_ms = 0
+
+    if args.plugins:
+        modules = args.plugins.split(',')
+    else:
+        modules = package_modules(api.packages_path_)
+    for modulename in modules:
+        sublime_plugin.reload_plugin(modulename)
+
+    events = read_trace(args.trace)
+    if not any(name == 'on_api_ready' for name, event_args in events):
+        sublime_plugin.on_api_ready()
+
+    summary = summarise(replay(events, api, sublime_plugin, args.repeat))
+    sys.__stdout__.write(format_summary(summary))
+
+    if errors.count > 0:
+        sys.__stdout__.write("%d exceptions were raised while replaying\n" % errors.count)
+        if not args.allow_errors:
+            return 2
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        found = regressions(summary, baseline, args.tolerance)
+        for name, before, after in found:
+            sys.__stdout__.write("%s regressed: %.1f ms -> %.1f ms\n" % (name, before, after))
+        if found:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())